@@ -1,16 +1,37 @@
 import cv2
 import numpy as np
 import pyzbar.pyzbar as pyzbar
-import urllib.request
-from flask import Flask, render_template, jsonify, request
+from pyzbar.pyzbar import ZBarSymbol
+import requests
+from flask import Flask, render_template, jsonify, request, Response
 import threading
+import hashlib
+import queue
 import time
 import sqlite3
 import json
+import functools
+from collections import namedtuple
 from datetime import datetime
 import configparser
+import codecs
 import os
 
+# Optional: PyTurboJPEG (libjpeg-turbo) decodes the camera JPEGs a few
+# times faster than cv2.imdecode; fall back to OpenCV when not installed.
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJPF_GRAY
+    turbo_jpeg = TurboJPEG()
+except Exception:
+    turbo_jpeg = None
+
+# Optional: orjson parses and serializes JSON a few times faster than the
+# stdlib module; fall back to json when not installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 app = Flask(__name__)
 
 # --- paths ---
@@ -31,37 +52,63 @@ CAMERA_FRAME_SUFFIX = general.get('camera_frame_url_suffix', 'cam-hi.jpg')
 USE_WEBCAM = general.getboolean('use_webcam', fallback=False)
 WEBCAM_INDEX = general.getint('webcam_index', fallback=0)
 DB_PATH = general.get('db_path', 'trolley.db')
-CURRENCY_SYMBOL = general.get('currency_symbol', '\u20b9').encode('utf-8').decode('unicode_escape')
+# only run the escape decode when the config holds a literal backslash
+# sequence (e.g. the six characters \ u 2 0 b 9); configparser already
+# returns real characters otherwise
+_raw_symbol = general.get('currency_symbol', '\u20b9')
+CURRENCY_SYMBOL = codecs.decode(_raw_symbol, 'unicode_escape') if '\\' in _raw_symbol else _raw_symbol
 CURRENCY_MULTIPLIER = general.getfloat('currency_multiplier', fallback=1.0)
 RESCAN_DELAY = general.getfloat('rescan_delay_seconds', fallback=2.0)
+DECODE_MAX_WIDTH = general.getint('decode_max_width', fallback=640)
+SHOW_PREVIEW = general.getboolean('show_preview', fallback=False)
 FLASK_HOST = general.get('host', '0.0.0.0')
 FLASK_PORT = general.getint('port', fallback=5000)
 FLASK_DEBUG = general.getboolean('debug', fallback=False)
 
 # --- product database (loaded from products.json) ---
+# fixed-schema rows: a namedtuple is smaller than a per-row dict and
+# attribute access skips a dict lookup in the scan hot path; prices are
+# integer paise/cents so hot-path arithmetic is exact and round()-free
+Product = namedtuple('Product', ['name', 'price_cents', 'price_fmt'])
+
 product_database = {}
 
+# Memoized so repeat scans/API calls reuse the same interned key instead
+# of building a fresh string, which also speeds up the dict lookups.
+@functools.lru_cache(maxsize=1024)
+def _norm(barcode: str) -> str:
+    return barcode.strip().upper()
+
+_products_mtime = None
+
 def load_products_from_json(path=PRODUCTS_JSON_PATH):
-    global product_database
+    global product_database, _products_mtime
     if not os.path.exists(path):
         print(f"Products file not found: {path}. Using empty product list.")
         product_database = {}
         return
 
-    with open(path, 'r', encoding='utf-8') as f:
-        try:
-            raw = json.load(f)
-        except Exception as e:
-            print(f"Failed to parse products JSON: {e}")
-            product_database = {}
-            return
+    # a reload with an untouched file is a no-op
+    mtime = os.stat(path).st_mtime
+    if mtime == _products_mtime:
+        return
+
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        raw = orjson.loads(data) if orjson is not None else json.loads(data)
+    except Exception as e:
+        print(f"Failed to parse products JSON: {e}")
+        product_database = {}
+        return
+    _products_mtime = mtime
 
     # Normalize barcodes to UPPERCASE to ensure matching independent of case
     product_database = {}
     for barcode, info in raw.items():
         if not barcode:
             continue
-        bc = barcode.strip().upper()
+        bc = _norm(barcode)
         name = info.get('name', '').strip() if isinstance(info, dict) else str(info)
         price = 0.0
         if isinstance(info, dict):
@@ -76,12 +123,17 @@ def load_products_from_json(path=PRODUCTS_JSON_PATH):
             except Exception:
                 price = 0.0
 
-        product_database[bc] = {'name': name, 'price': round(price, 2)}
+        price_cents = int(round(price * 100))
+        # price_fmt is precomputed so hot paths concatenate instead of
+        # re-running float formatting per event
+        product_database[bc] = Product(
+            name, price_cents,
+            f"{CURRENCY_SYMBOL}{price_cents // 100}.{price_cents % 100:02d}")
 
     # Debug output
     print("Loaded products from products.json:")
     for bc, info in product_database.items():
-        print(f"  {bc} -> {info['name']}, {CURRENCY_SYMBOL}{info['price']:.2f}")
+        print(f"  {bc} -> {info.name}, {info.price_fmt}")
 
 # initial load
 load_products_from_json()
@@ -97,23 +149,85 @@ def init_db():
                   barcode TEXT,
                   quantity INTEGER DEFAULT 1,
                   timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    # one row per barcode per day; lets the writer use a single UPSERT
+    c.execute('''CREATE UNIQUE INDEX IF NOT EXISTS ux_barcode_day
+                 ON products(barcode, date(timestamp))''')
     conn.commit()
     conn.close()
 
 init_db()
 
+# Long-lived connection shared by the app: WAL avoids writer/reader
+# blocking and synchronous=NORMAL drops the per-commit fsync cost.
+db_conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None,
+                          cached_statements=256)
+db_conn.execute('PRAGMA journal_mode=WAL')
+db_conn.execute('PRAGMA synchronous=NORMAL')
+db_conn.execute('PRAGMA busy_timeout=5000')
+db_lock = threading.Lock()
+
+# --- camera HTTP session (reused across frames to keep the TCP connection open) ---
+camera_session = requests.Session()
+camera_session.headers['Connection'] = 'keep-alive'
+
 # --- shared state ---
 scanned_products = []
-total_amount = 0.0
-last_scan = {"barcode": "", "time": 0}
+scanned_index = {}  # barcode -> item dict, parallel to scanned_products
+cart_lock = threading.Lock()
+total_cents = 0  # integer paise/cents; converted to a decimal at the API boundary
+last_scan = {"barcode_bytes": b"", "time": 0.0}
 font = cv2.FONT_HERSHEY_PLAIN
 
-# --- scanner thread ---
-def qr_scanner():
-    global scanned_products, total_amount, last_scan
-
-    cv2.namedWindow("Smart Trolley - QR Scanner", cv2.WINDOW_AUTOSIZE)
-
+# the "Product Added!" banner never changes, so rasterize it once and
+# blit it onto preview frames instead of re-rendering the text each time
+if SHOW_PREVIEW:
+    banner_overlay = np.zeros((150, 800, 3), np.uint8)
+    cv2.putText(banner_overlay, f"Product Added! ({CURRENCY_SYMBOL})", (50, 100),
+                font, 2, (0, 255, 0), 3)
+else:
+    banner_overlay = None
+
+# Cart state only changes on scanner/API events, so /api/cart serves a
+# prerendered JSON payload instead of rebuilding it on every poll.
+_cart_cache = {'etag': '', 'body': b''}
+
+# wakes /api/cart/stream subscribers whenever the cart changes
+cart_cond = threading.Condition()
+
+def _refresh_cart_cache():
+    # caller must hold cart_lock; internal cents become decimal amounts here
+    payload = {
+        'products': [{
+            'name': item['name'],
+            'price': item['price_cents'] / 100,
+            'barcode': item['barcode'],
+            'quantity': item['quantity'],
+            'total': item['total_cents'] / 100
+        } for item in scanned_products],
+        'total_amount': total_cents / 100,
+        'item_count': len(scanned_products),
+        'currency_symbol': CURRENCY_SYMBOL
+    }
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload).encode('utf-8')
+    _cart_cache['body'] = body
+    _cart_cache['etag'] = hashlib.md5(body).hexdigest()
+    with cart_cond:
+        cart_cond.notify_all()
+
+with cart_lock:
+    _refresh_cart_cache()
+
+# --- frame grabber thread (producer) ---
+# Keeps only the newest frame: if decoding falls behind the camera supply
+# rate, stale frames are overwritten instead of queueing up, so detection
+# latency stays bounded.
+latest_frame = {'frame': None}
+latest_frame_lock = threading.Lock()
+
+def frame_grabber():
     cap = None
     if USE_WEBCAM:
         cap = cv2.VideoCapture(WEBCAM_INDEX)
@@ -130,92 +244,170 @@ def qr_scanner():
                     time.sleep(1)
                     continue
             else:
-                img_resp = urllib.request.urlopen(url + frame_suffix, timeout=5)
-                imgnp = np.array(bytearray(img_resp.read()), dtype=np.uint8)
-                frame = cv2.imdecode(imgnp, -1)
+                img_resp = camera_session.get(url + frame_suffix, timeout=5)
+                if turbo_jpeg is not None:
+                    # headless: decode straight to luminance, skipping the
+                    # chroma planes pyzbar never looks at
+                    pixel_format = TJPF_BGR if SHOW_PREVIEW else TJPF_GRAY
+                    frame = turbo_jpeg.decode(img_resp.content,
+                                              pixel_format=pixel_format)
+                else:
+                    # frombuffer is a zero-copy view over the response bytes,
+                    # avoiding the bytes -> bytearray -> ndarray double copy
+                    imgnp = np.frombuffer(img_resp.content, dtype=np.uint8)
+                    flags = cv2.IMREAD_COLOR if SHOW_PREVIEW else cv2.IMREAD_GRAYSCALE
+                    frame = cv2.imdecode(imgnp, flags)
+
+            with latest_frame_lock:
+                latest_frame['frame'] = frame
+        except Exception as e:
+            print(f"Error in camera feed: {e}")
+            time.sleep(1)
+
+# --- scanner thread (consumer) ---
+def qr_scanner():
+    global scanned_products, last_scan
 
-            decoded_objects = pyzbar.decode(frame)
+    if SHOW_PREVIEW:
+        cv2.namedWindow("Smart Trolley - QR Scanner", cv2.WINDOW_AUTOSIZE)
+
+    while True:
+        try:
+            with latest_frame_lock:
+                frame = latest_frame['frame']
+                latest_frame['frame'] = None
+            if frame is None:
+                time.sleep(0.005)
+                continue
+
+            # pyzbar cost scales with pixel count and only needs luminance,
+            # so decode a downscaled grayscale copy; keep `frame` for display
+            scale = min(1.0, DECODE_MAX_WIDTH / frame.shape[1])
+            if scale < 1.0:
+                small = cv2.resize(frame, None, fx=scale, fy=scale,
+                                   interpolation=cv2.INTER_AREA)
+            else:
+                small = frame
+            if small.ndim == 2:
+                gray = small  # grabber already decoded to grayscale
+            elif small.shape[2] == 1:
+                gray = small[:, :, 0]
+            else:
+                gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+            # only QR codes are used on the trolley labels; skipping the
+            # other ZBar symbology passes (EAN/UPC/Code128/...) per frame
+            decoded_objects = pyzbar.decode(gray, symbols=[ZBarSymbol.QRCODE])
 
             for obj in decoded_objects:
-                barcode_data = obj.data.decode('utf-8').strip()
+                raw = obj.data
+                current_time = time.monotonic()
+
+                # in the steady state the same QR code sits in front of the
+                # camera; rejecting repeats on the raw bytes skips the
+                # utf-8 decode and normalization entirely
+                if raw == last_scan["barcode_bytes"] and (current_time - last_scan["time"]) <= RESCAN_DELAY:
+                    continue
+
+                barcode_data = raw.decode('utf-8').strip()
                 if not barcode_data:
                     continue
                 # normalize to uppercase to match product_database keys
-                barcode_lookup = barcode_data.upper()
-                current_time = time.time()
-
-                if last_scan["barcode"] != barcode_lookup or (current_time - last_scan["time"]) > RESCAN_DELAY:
-                    print("Type:", obj.type)
-                    print("Data:", barcode_data)
-                    last_scan["barcode"] = barcode_lookup
-                    last_scan["time"] = current_time
-                    process_barcode(barcode_lookup)
-
-                cv2.putText(frame, str(barcode_data), (50, 50), font, 2,
-                           (255, 0, 0), 3)
-                cv2.putText(frame, f"Product Added! ({CURRENCY_SYMBOL})", (50, 100), font, 2,
-                           (0, 255, 0), 3)
-
-            cv2.imshow("Smart Trolley - QR Scanner", frame)
-            key = cv2.waitKey(1)
-            if key == 27:  # ESC
-                break
+                barcode_lookup = _norm(barcode_data)
+
+                print("Type:", obj.type)
+                print("Data:", barcode_data)
+                last_scan["barcode_bytes"] = raw
+                last_scan["time"] = current_time
+                process_barcode(barcode_lookup)
+
+                if SHOW_PREVIEW:
+                    # only the barcode line is dynamic; the banner is blitted
+                    cv2.putText(frame, str(barcode_data), (50, 50), font, 2,
+                               (255, 0, 0), 3)
+                    h = min(banner_overlay.shape[0], frame.shape[0])
+                    w = min(banner_overlay.shape[1], frame.shape[1])
+                    roi = frame[:h, :w]
+                    np.maximum(roi, banner_overlay[:h, :w], out=roi)
+
+            if SHOW_PREVIEW:
+                cv2.imshow("Smart Trolley - QR Scanner", frame)
+                key = cv2.waitKey(1)
+                if key == 27:  # ESC
+                    break
 
         except Exception as e:
-            print(f"Error in camera feed: {e}")
+            print(f"Error in scanner: {e}")
             time.sleep(1)
 
-    cv2.destroyAllWindows()
-    if cap:
-        cap.release()
+    if SHOW_PREVIEW:
+        cv2.destroyAllWindows()
 
 # --- barcode processing ---
 def process_barcode(barcode_data_upper):
-    global scanned_products, total_amount
+    global scanned_products, total_cents
 
     if barcode_data_upper in product_database:
         product = product_database[barcode_data_upper]
 
-        # find existing
-        found = False
-        for item in scanned_products:
-            if item['barcode'] == barcode_data_upper:
+        with cart_lock:
+            item = scanned_index.get(barcode_data_upper)
+            if item is not None:
+                delta = item['price_cents']
                 item['quantity'] += 1
-                item['total'] = round(item['quantity'] * item['price'], 2)
-                found = True
-                break
-
-        if not found:
-            new_product = {
-                'name': product['name'],
-                'price': product['price'],
-                'barcode': barcode_data_upper,
-                'quantity': 1,
-                'total': round(product['price'], 2)
-            }
-            scanned_products.append(new_product)
-
-        total_amount = round(sum(item['total'] for item in scanned_products), 2)
-        save_to_database(barcode_data_upper, product['name'], product['price'])
-        print(f"Added: {product['name']} - {CURRENCY_SYMBOL}{product['price']:.2f}")
+                item['total_cents'] += delta
+                total_cents += delta
+            else:
+                new_product = {
+                    'name': product.name,
+                    'price_cents': product.price_cents,
+                    'barcode': barcode_data_upper,
+                    'quantity': 1,
+                    'total_cents': product.price_cents
+                }
+                scanned_products.append(new_product)
+                scanned_index[barcode_data_upper] = new_product
+                total_cents += product.price_cents
+            _refresh_cart_cache()
+
+        write_q.put((product.name, product.price_cents / 100, barcode_data_upper))
+        print(f"Added: {product.name} - {product.price_fmt}")
     else:
         print(f"Product not found for barcode: {barcode_data_upper}")
 
-# --- DB write ---
-def save_to_database(barcode, name, price):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''SELECT * FROM products WHERE barcode=? 
-                 AND DATE(timestamp)=DATE('now')''', (barcode,))
-    existing = c.fetchone()
-    if existing:
-        c.execute('''UPDATE products SET quantity=quantity+1 
-                     WHERE barcode=? AND DATE(timestamp)=DATE('now')''', (barcode,))
-    else:
-        c.execute('''INSERT INTO products (name, price, barcode, quantity)
-                     VALUES (?, ?, ?, 1)''', (name, price, barcode))
-    conn.commit()
-    conn.close()
+# --- DB writes (queued; a dedicated thread batches them per transaction) ---
+UPSERT_SQL = '''INSERT INTO products (name, price, barcode, quantity)
+                VALUES (?, ?, ?, 1)
+                ON CONFLICT(barcode, date(timestamp))
+                DO UPDATE SET quantity = quantity + 1'''
+
+write_q = queue.Queue()
+
+def db_writer():
+    # Drain up to 50 queued writes (waiting at most 100ms for stragglers)
+    # and commit them in one transaction, so the scanner thread never
+    # blocks on disk and SQLite pays one fsync per batch. One cursor is
+    # reused for the thread's lifetime so the prepared UPSERT stays hot
+    # in the connection's statement cache.
+    db_cur = db_conn.cursor()
+    while True:
+        batch = [write_q.get()]
+        deadline = time.time() + 0.1
+        while len(batch) < 50:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(write_q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        with db_lock:
+            try:
+                db_cur.execute('BEGIN')
+                db_cur.executemany(UPSERT_SQL, batch)
+                db_cur.execute('COMMIT')
+            except Exception as e:
+                db_cur.execute('ROLLBACK')
+                print(f"DB write failed: {e}")
 
 # --- Flask endpoints ---
 @app.route('/')
@@ -224,53 +416,88 @@ def index():
 
 @app.route('/api/cart')
 def get_cart():
-    return jsonify({
-        'products': scanned_products,
-        'total_amount': total_amount,
-        'item_count': len(scanned_products),
-        'currency_symbol': CURRENCY_SYMBOL
-    })
+    etag = _cart_cache['etag']
+    if request.headers.get('If-None-Match') == etag:
+        return Response(status=304, headers={'ETag': etag})
+    return Response(_cart_cache['body'], mimetype='application/json',
+                    headers={'ETag': etag})
+
+@app.route('/api/cart/stream')
+def cart_stream():
+    # Server-sent events: pushes the cached cart payload when it changes,
+    # so the UI can use an EventSource instead of polling /api/cart.
+    def generate():
+        last_etag = None
+        while True:
+            # check the predicate under the condition before waiting, so a
+            # mutation landing while the previous event was being written
+            # out is seen immediately instead of after the wait timeout
+            with cart_cond:
+                if _cart_cache['etag'] == last_etag:
+                    cart_cond.wait(timeout=15.0)
+                etag = _cart_cache['etag']
+                body = _cart_cache['body']
+            if etag != last_etag:
+                last_etag = etag
+                yield b'data: ' + body + b'\n\n'
+            else:
+                yield b': keep-alive\n\n'  # comment line keeps proxies open
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
 
 @app.route('/api/clear')
 def clear_cart():
-    global scanned_products, total_amount
-    scanned_products = []
-    total_amount = 0.0
+    global total_cents
+    with cart_lock:
+        scanned_products.clear()
+        scanned_index.clear()
+        total_cents = 0
+        _refresh_cart_cache()
     return jsonify({'status': 'success'})
 
 @app.route('/api/remove/<barcode>')
 def remove_item(barcode):
-    global scanned_products, total_amount
-    bc = barcode.strip().upper()
-    scanned_products[:] = [item for item in scanned_products if item['barcode'] != bc]
-    total_amount = round(sum(item['total'] for item in scanned_products), 2)
+    global total_cents
+    bc = _norm(barcode)
+    with cart_lock:
+        item = scanned_index.pop(bc, None)
+        if item is not None:
+            scanned_products.remove(item)
+            total_cents -= item['total_cents']
+            _refresh_cart_cache()
     return jsonify({'status': 'success'})
 
 @app.route('/api/increase/<barcode>')
 def increase_quantity(barcode):
-    global scanned_products, total_amount
-    bc = barcode.strip().upper()
-    for item in scanned_products:
-        if item['barcode'] == bc:
+    global total_cents
+    bc = _norm(barcode)
+    with cart_lock:
+        item = scanned_index.get(bc)
+        if item is not None:
+            delta = item['price_cents']
             item['quantity'] += 1
-            item['total'] = round(item['quantity'] * item['price'], 2)
-            break
-    total_amount = round(sum(item['total'] for item in scanned_products), 2)
+            item['total_cents'] += delta
+            total_cents += delta
+            _refresh_cart_cache()
     return jsonify({'status': 'success'})
 
 @app.route('/api/decrease/<barcode>')
 def decrease_quantity(barcode):
-    global scanned_products, total_amount
-    bc = barcode.strip().upper()
-    for item in scanned_products:
-        if item['barcode'] == bc:
+    global total_cents
+    bc = _norm(barcode)
+    with cart_lock:
+        item = scanned_index.get(bc)
+        if item is not None:
             if item['quantity'] > 1:
+                delta = item['price_cents']
                 item['quantity'] -= 1
-                item['total'] = round(item['quantity'] * item['price'], 2)
+                item['total_cents'] -= delta
+                total_cents -= delta
             else:
                 scanned_products.remove(item)
-            break
-    total_amount = round(sum(item['total'] for item in scanned_products), 2)
+                del scanned_index[bc]
+                total_cents -= item['total_cents']
+            _refresh_cart_cache()
     return jsonify({'status': 'success'})
 
 # --- admin endpoint to reload products.json at runtime ---
@@ -281,6 +508,20 @@ def reload_products():
 
 # --- run ---
 if __name__ == '__main__':
+    writer_thread = threading.Thread(target=db_writer, daemon=True)
+    writer_thread.start()
+    grabber_thread = threading.Thread(target=frame_grabber, daemon=True)
+    grabber_thread.start()
     scanner_thread = threading.Thread(target=qr_scanner, daemon=True)
     scanner_thread.start()
-    app.run(host=FLASK_HOST, port=FLASK_PORT, debug=FLASK_DEBUG)
+    if FLASK_DEBUG:
+        # debug mode needs Werkzeug's reloader/debugger
+        app.run(host=FLASK_HOST, port=FLASK_PORT, debug=True, threaded=True)
+    else:
+        try:
+            from waitress import serve
+            serve(app, host=FLASK_HOST, port=FLASK_PORT, threads=8)
+        except ImportError:
+            # threaded=True so concurrent /api/cart pollers are served in
+            # parallel instead of queueing on the single-threaded dev loop
+            app.run(host=FLASK_HOST, port=FLASK_PORT, threaded=True)